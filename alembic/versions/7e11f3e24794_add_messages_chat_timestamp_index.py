@@ -0,0 +1,31 @@
+"""Add messages chat timestamp index
+
+Revision ID: 7e11f3e24794
+Revises: 3b38848cd267
+Create Date: 2026-10-15 08:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e11f3e24794'
+down_revision: Union[str, None] = '3b38848cd267'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_messages_chat_ts',
+        'messages',
+        ['chat_id', sa.text('timestamp DESC'), sa.text('id DESC')],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_messages_chat_ts', table_name='messages')
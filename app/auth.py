@@ -1,10 +1,15 @@
+import hashlib
 import os
+import threading
+import time
 
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from jose.backends import RSAKey
 from keycloak.keycloak_openid import KeycloakOpenID
-from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
@@ -21,18 +26,31 @@ keycloak_openid = KeycloakOpenID(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+PUBLIC_KEY = (
+    "-----BEGIN PUBLIC KEY-----\n"
+    "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAx3V7fKMuAO055R158iL18lehMdjFOZr1P7tmvrbQK3v/9hgbB6ROhOAmT1Aj+ml7rNMb+eMeJEPvDuE5sQm9hMUAU88bWC/pqWyCIegEEWEixeItUrBZLxEsmWagF5wFc90juNxu0qXEf2r/oKuRSdWuJXRx4IRkZm24XzlTLI/z7DZUvRL3t4e/XpnLgb8dVRw/xSmrqAFnbXbRaESDpp77KhTKlhxkVBiT5rBKRwAwI3a7kEYEFtvX3wpRimGPOh/uogtbHn1wKPmFLfpcchu6eIozvWTcVPkfPPSqOwS7HyYlHUdMS+MSjKlmM9dBCh81kgxRWbXLkz0vf6dQ3QIDAQAB"
+    "\n-----END PUBLIC KEY-----"
+)
+# Klucz parsowany raz przy imporcie zamiast przy każdym jwt.decode
+_RSA_KEY = RSAKey(PUBLIC_KEY, algorithm="RS256")
+
+# Zweryfikowane tokeny (payload) - verify_token działa w threadpoolu, stąd lock
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+_token_cache_lock = threading.Lock()
+
 
 def verify_token(token: str = Depends(oauth2_scheme)):
+    # Klucz cache to skrót tokenu, żeby nie trzymać w pamięci surowych JWT
+    cache_key = hashlib.sha256(token.encode()).hexdigest()[:32]
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
+
     try:
-        public_key = (
-            "-----BEGIN PUBLIC KEY-----\n"
-            + "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAx3V7fKMuAO055R158iL18lehMdjFOZr1P7tmvrbQK3v/9hgbB6ROhOAmT1Aj+ml7rNMb+eMeJEPvDuE5sQm9hMUAU88bWC/pqWyCIegEEWEixeItUrBZLxEsmWagF5wFc90juNxu0qXEf2r/oKuRSdWuJXRx4IRkZm24XzlTLI/z7DZUvRL3t4e/XpnLgb8dVRw/xSmrqAFnbXbRaESDpp77KhTKlhxkVBiT5rBKRwAwI3a7kEYEFtvX3wpRimGPOh/uogtbHn1wKPmFLfpcchu6eIozvWTcVPkfPPSqOwS7HyYlHUdMS+MSjKlmM9dBCh81kgxRWbXLkz0vf6dQ3QIDAQAB"
-            + "\n-----END PUBLIC KEY-----"
-        )
         decoded_token = jwt.decode(
-            token, public_key, algorithms=["RS256"], options={"verify_aud": False}
+            token, _RSA_KEY, algorithms=["RS256"], options={"verify_aud": False}
         )
-        return decoded_token
     except JWTError as exc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,14 +58,23 @@ def verify_token(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         ) from exc
 
+    with _token_cache_lock:
+        _token_cache[cache_key] = decoded_token
+    return decoded_token
+
 
 @router.get("/protected")
 async def get_current_user(
     user=Depends(verify_token), db: AsyncSession = Depends(get_db)
 ):
-    user_db = await db.execute(select(User).where(User.id == user["sub"]))
-    user_db = user_db.scalar()
+    user_db = await db.get(User, user["sub"])
     if not user_db:
-        user_db = User(id=user["sub"], username=user["preferred_username"])
-        db.add(user_db)
+        # Ignorujemy tylko wyścig równoległych żądań o ten sam klucz główny;
+        # konflikt na unikalnym username ma się zakończyć błędem, a nie po cichu
+        await db.execute(
+            pg_insert(User)
+            .values(id=user["sub"], username=user["preferred_username"])
+            .on_conflict_do_nothing(index_elements=[User.id])
+        )
+        await db.commit()
     return user
@@ -17,7 +17,7 @@ async def init_user_index(es_client):
         },
         "mappings": {
             "properties": {
-                "username": {"type": "text"},
+                "username": {"type": "search_as_you_type"},
             }
         },
     }
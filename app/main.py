@@ -1,21 +1,40 @@
 from contextlib import asynccontextmanager
 
+import httpx
+import uvloop
 from fastapi import FastAPI
 
+from app.database import warm_up_pool
+from app.message_writer import message_writer
 from app.routers import auth, chat, users
+from app.routers.chat import manager
 from app.es import init_indices, wait_for_elasticsearch, get_es_instance
 
+uvloop.install()
+
 
 @asynccontextmanager
-async def lifespan(_: FastAPI):
+async def lifespan(app: FastAPI):
     es = get_es_instance()
     if not await wait_for_elasticsearch(es):
         raise Exception("Elasticsearch is not available after waiting")
 
     await init_indices(es)
+    await warm_up_pool()
+    await message_writer.start()
+
+    await manager.start_listening()
+    app.state.http = httpx.AsyncClient(
+        timeout=5,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+    )
 
     yield
 
+    await message_writer.stop()
+    await app.state.http.aclose()
+    await manager.stop_listening()
+
 
 app = FastAPI(lifespan=lifespan)
 
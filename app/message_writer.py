@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+from sqlalchemy import String, bindparam, insert, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.database import SessionLocal
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+# (wiadomość, kanał NOTIFY, payload NOTIFY, wywoływane, gdy zapis się nie uda)
+PendingMessage = Tuple[Message, str, str, Optional[Callable[[], None]]]
+
+WRITER_TASKS = 4
+MAX_WRITE_BATCH = 100
+WRITE_BATCH_WINDOW = 0.02  # sekundy
+ID_BLOCK_SIZE = 100
+WRITE_RETRIES = 3
+WRITE_RETRY_DELAY = 0.1  # sekundy, podwajane przy każdej próbie
+
+# Powiadomienia dla całej paczki jednym zapytaniem, w tej samej transakcji co INSERT
+NOTIFY_BATCH = text(
+    "SELECT pg_notify(channel, payload) "
+    "FROM unnest(:channels, :payloads) AS t(channel, payload)"
+).bindparams(
+    bindparam("channels", type_=ARRAY(String)),
+    bindparam("payloads", type_=ARRAY(String)),
+)
+
+
+class MessageWriter:
+    """Zapisuje wiadomości do bazy paczkami i rozsyła je przez NOTIFY"""
+
+    def __init__(self):
+        # Osobna kolejka dla każdego zadania zapisu; pokój zawsze trafia do tej samej,
+        # więc jego wiadomości są zapisywane (i rozsyłane) w kolejności wysłania
+        self.queues: List[asyncio.Queue] = [
+            asyncio.Queue() for _ in range(WRITER_TASKS)
+        ]
+        self.tasks: List[asyncio.Task] = []
+        self._ids: Deque[int] = deque()  # Zarezerwowane wartości messages_id_seq
+        self._ids_lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        """Zwraca id nowej wiadomości, rezerwując sekwencję blokami"""
+        async with self._ids_lock:
+            if not self._ids:
+                async with SessionLocal() as session:  # type: ignore
+                    result = await session.execute(
+                        text(
+                            "SELECT nextval('messages_id_seq') "
+                            "FROM generate_series(1, :n)"
+                        ),
+                        {"n": ID_BLOCK_SIZE},
+                    )
+                    self._ids.extend(row[0] for row in result)
+            return self._ids.popleft()
+
+    def enqueue(
+        self,
+        message: Message,
+        channel: str,
+        payload: str,
+        on_failure: Optional[Callable[[], None]] = None,
+    ):
+        """Dodaje wiadomość do kolejki zapisu; payload trafi na kanał po commicie"""
+        queue = self.queues[message.chat_id % WRITER_TASKS]
+        queue.put_nowait((message, channel, payload, on_failure))
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._run(queue)) for queue in self.queues]
+
+    async def stop(self):
+        """Zapisuje zaległe wiadomości i zatrzymuje zadania zapisu"""
+        for queue in self.queues:
+            await queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[PendingMessage] = [await queue.get()]
+            deadline = loop.time() + WRITE_BATCH_WINDOW
+            while len(batch) < MAX_WRITE_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write_with_retry(self, batch: List[PendingMessage]):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                await self._write(batch)
+                return
+            except Exception:
+                logger.warning(
+                    "Próba %d zapisu %d wiadomości nieudana",
+                    attempt + 1,
+                    len(batch),
+                    exc_info=True,
+                )
+                if attempt + 1 < WRITE_RETRIES:
+                    await asyncio.sleep(WRITE_RETRY_DELAY * 2**attempt)
+
+        # Paczka nadal nie przechodzi - zapisujemy pojedynczo, żeby jedna wadliwa
+        # wiadomość nie blokowała pozostałych
+        for item in batch:
+            try:
+                await self._write([item])
+            except Exception:
+                message, _, _, on_failure = item
+                logger.exception(
+                    "Nie udało się zapisać wiadomości %d (czat %s, nadawca %s)",
+                    message.id,
+                    message.chat_id,
+                    message.sender,
+                )
+                if on_failure is not None:
+                    on_failure()
+
+    async def _write(self, batch: List[PendingMessage]):
+        """Wstawia paczkę i wysyła jej NOTIFY w jednej transakcji"""
+        # Wiersze zamiast obiektów ORM, żeby ponowienie nie zależało od stanu sesji
+        rows = [
+            {
+                "id": message.id,
+                "chat_id": message.chat_id,
+                "sender": message.sender,
+                "content": message.content,
+                "timestamp": message.timestamp,
+            }
+            for message, *_ in batch
+        ]
+        async with SessionLocal() as session:  # type: ignore
+            await session.execute(insert(Message), rows)
+            await session.execute(
+                NOTIFY_BATCH,
+                {
+                    "channels": [channel for _, channel, _, _ in batch],
+                    "payloads": [payload for _, _, payload, _ in batch],
+                },
+            )
+            await session.commit()
+
+
+message_writer = MessageWriter()
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -43,3 +43,7 @@ class Message(Base):
     sender = Column(String, index=True)
     content = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_messages_chat_ts", chat_id, timestamp.desc(), id.desc()),
+    )
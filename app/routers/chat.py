@@ -1,36 +1,188 @@
 import asyncio
-import json
-import os
-from typing import Dict, List, Set
+import functools
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
 
-import aioredis
+import asyncpg
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+import orjson
+import xxhash
+from cachetools import TTLCache
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import and_, exists, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload, selectinload
 
 from app.auth import get_current_user, verify_token
-from app.database import get_db
-from app.models import Chat, Message, User
+from app.database import SessionLocal, create_listen_connection, get_db
+from app.message_writer import message_writer
+from app.models import Chat, Message, User, user_chat_association
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/chat")
 ws_router = APIRouter()
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+SEND_TIMEOUT = 5
+MAX_BATCH_SIZE = 64
+MAX_QUEUED_MESSAGES = 1000
+
+# Liczba kanałów NOTIFY; worker nasłuchuje tylko shardów z aktywnymi pokojami
+N_SHARDS = 16
+# Postgres odrzuca NOTIFY z payloadem od 8000 bajtów; dłuższe wiadomości
+# rozsyłamy jako samo id, a nasłuchujący doczytują je z bazy
+MAX_NOTIFY_PAYLOAD = 7999
+# Jak długo (w sekundach) trzymamy LISTEN po wyjściu ostatniego klienta z sharda
+LISTEN_GRACE_PERIOD = 60
+# Maksymalna przerwa (w sekundach) między próbami odtworzenia połączenia LISTEN
+MAX_RECONNECT_DELAY = 30
+
+USERS_API_URL = "http://user_service:8000/admin/api/users/users"
+
+# Zdjęcia profilowe z user_service (również None, gdy użytkownik go nie ma)
+_picture_cache: TTLCache = TTLCache(maxsize=50_000, ttl=300)
+_MISSING = object()
+
+
+def shard_of(chat_id: str) -> int:
+    """Zwraca numer sharda, do którego należy pokój czatu"""
+    return xxhash.xxh64_intdigest(chat_id) % N_SHARDS
+
+
+def message_payload(message: Message) -> dict:
+    """Treść wiadomości wysyłana klientom WebSocket"""
+    return {
+        "id": message.id,
+        "sender": message.sender,
+        "content": message.content,
+        "timestamp": message.timestamp,
+    }
+
+
+def shard_channel(shard: int) -> str:
+    """Nazwa kanału NOTIFY dla sharda"""
+    return f"chat_{shard}"
+
+
+def chat_channel(chat_id: str) -> str:
+    """Nazwa kanału NOTIFY dla pokoju czatu"""
+    return shard_channel(shard_of(chat_id))
 
 
 class ConnectionManager:
-    """Zarządza połączeniami WebSocket i jednorazowym nasłuchem Redis"""
+    """Zarządza połączeniami WebSocket i nasłuchem LISTEN na kanałach czatu"""
 
     def __init__(self):
         self.rooms: Dict[str, Set[WebSocket]] = (
             {}
         )  # Przechowuje połączenia WebSocket dla każdego pokoju
-        self.redis_tasks: Dict[str, asyncio.Task] = (
+        self.listen_conn: Optional[asyncpg.Connection] = None  # Połączenie do LISTEN
+        self.listening: Set[int] = set()  # Shardy z aktywnym LISTEN
+        self.reconnect_task: Optional[asyncio.Task] = None
+        # Powiadomienia czekające na doczytanie z bazy, w kolejności odbioru
+        self.deliveries: asyncio.Queue = asyncio.Queue()
+        self.delivery_backlog = 0
+        self.delivery_task: Optional[asyncio.Task] = None
+        self.stopping = False
+        # asyncpg nie pozwala na równoległe zapytania na jednym połączeniu
+        self.listen_lock = asyncio.Lock()
+        # Aktywne pokoje w danym shardzie
+        self.shard_rooms: Dict[int, Set[str]] = defaultdict(set)
+        self.unlisten_tasks: Dict[int, asyncio.Task] = (
+            {}
+        )  # Opóźnione UNLISTEN dla shardów bez pokoi
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = (
             {}
-        )  # Przechowuje jednorazowy nasłuch Redis
+        )  # Zadanie wysyłające wiadomości do danego WebSocketu
+        self.queues: Dict[WebSocket, asyncio.Queue] = (
+            {}
+        )  # Kolejka wiadomości oczekujących na wysłanie
+        self.close_tasks: Set[asyncio.Task] = set()  # Zamykanie odłączonych klientów
+
+    async def start_listening(self):
+        """Otwiera połączenie do LISTEN, odtwarzane automatycznie po zerwaniu"""
+        self.stopping = False
+        self.listen_conn = await create_listen_connection()
+        self.listen_conn.add_termination_listener(self._on_listen_terminated)
+        self.delivery_task = asyncio.create_task(self._deliver_pending())
+
+    async def stop_listening(self):
+        """Zamyka połączenie do LISTEN bez ponownego łączenia"""
+        self.stopping = True
+        # Oczekujące UNLISTEN nie mają już sensu, a ich zadania nie mogą przeżyć pętli
+        tasks = list(self.unlisten_tasks.values())
+        self.unlisten_tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            await asyncio.gather(self.reconnect_task, return_exceptions=True)
+            self.reconnect_task = None
+        if self.listen_conn is not None:
+            await self.listen_conn.close()
+            self.listen_conn = None
+        if self.delivery_task is not None:
+            self.delivery_task.cancel()
+            await asyncio.gather(self.delivery_task, return_exceptions=True)
+            self.delivery_task = None
+
+    def _on_listen_terminated(self, _conn):
+        if self.stopping or self.reconnect_task is not None:
+            return
+        logger.warning("Połączenie LISTEN zerwane, łączymy ponownie")
+        self.reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        """Odtwarza połączenie LISTEN i nasłuch wszystkich aktywnych shardów"""
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = await create_listen_connection()
+                conn.add_termination_listener(self._on_listen_terminated)
+                async with self.listen_lock:
+                    # Kopia, bo connect/_unlisten_later zmieniają zbiór w trakcie
+                    for shard in list(self.listening):
+                        await conn.add_listener(shard_channel(shard), self._on_notify)
+                    self.listen_conn = conn
+                break
+            except Exception:
+                logger.warning(
+                    "Nie udało się odtworzyć LISTEN, ponowienie za %d s",
+                    delay,
+                    exc_info=True,
+                )
+                if conn is not None:
+                    conn.terminate()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+        self.reconnect_task = None
+        # Połączenie mogło paść, zanim zdjęliśmy blokadę ponownego łączenia
+        if conn.is_closed():
+            self._on_listen_terminated(conn)
+
+    async def _listen(self, channel: str):
+        async with self.listen_lock:
+            # Przy zerwanym połączeniu nasłuch odtworzy _reconnect
+            if self.listen_conn is not None and not self.listen_conn.is_closed():
+                await self.listen_conn.add_listener(channel, self._on_notify)
+
+    async def _unlisten(self, channel: str):
+        async with self.listen_lock:
+            if self.listen_conn is not None and not self.listen_conn.is_closed():
+                await self.listen_conn.remove_listener(channel, self._on_notify)
 
     async def connect(self, chat_id: str, websocket: WebSocket):
         """Dodaje WebSocket do listy aktywnych połączeń w danym pokoju"""
@@ -39,45 +191,146 @@ class ConnectionManager:
             self.rooms[chat_id] = set()
         self.rooms[chat_id].add(websocket)
 
-        # Jeśli jeszcze nie ma nasłuchu dla tego pokoju, uruchamiamy go
-        if chat_id not in self.redis_tasks:
-            self.redis_tasks[chat_id] = asyncio.create_task(
-                self.listen_to_redis(chat_id)
-            )
+        queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUED_MESSAGES)
+        self.queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(
+            self._writer(chat_id, websocket, queue)
+        )
+
+        shard = shard_of(chat_id)
+        self.shard_rooms[shard].add(chat_id)
+
+        # Klient wrócił w okresie karencji - nasłuch zostaje
+        pending = self.unlisten_tasks.pop(shard, None)
+        if pending is not None:
+            pending.cancel()
+
+        # Jeśli jeszcze nie ma nasłuchu dla tego sharda, uruchamiamy go
+        if shard not in self.listening:
+            self.listening.add(shard)
+            await self._listen(shard_channel(shard))
 
     async def disconnect(self, chat_id: str, websocket: WebSocket):
         """Usuwa WebSocket z listy aktywnych połączeń"""
+        self._drop(chat_id, websocket)
+        writer = self.writer_tasks.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
+
+        if chat_id in self.rooms and not self.rooms[chat_id]:
+            del self.rooms[chat_id]
+            shard = shard_of(chat_id)
+            self.shard_rooms[shard].discard(chat_id)
+            if not self.shard_rooms[shard]:
+                # Jeśli shard nie ma już pokoi, kończymy nasłuch po okresie karencji
+                del self.shard_rooms[shard]
+                self.unlisten_tasks[shard] = asyncio.create_task(
+                    self._unlisten_later(shard)
+                )
+
+    async def _unlisten_later(self, shard: int):
+        """Kończy nasłuch sharda, jeśli przez LISTEN_GRACE_PERIOD nikt nie dołączył"""
+        await asyncio.sleep(LISTEN_GRACE_PERIOD)
+        del self.unlisten_tasks[shard]
+        self.listening.discard(shard)
+        try:
+            await self._unlisten(shard_channel(shard))
+        except Exception:
+            logger.exception("Nie udało się zakończyć nasłuchu sharda %d", shard)
+
+    def _drop(self, chat_id: str, websocket: WebSocket):
+        """Przestaje dostarczać wiadomości do danego WebSocketu"""
         if chat_id in self.rooms:
             self.rooms[chat_id].discard(websocket)
-            if not self.rooms[chat_id]:  # Jeśli pokój jest pusty, usuwamy nasłuch Redis
-                del self.rooms[chat_id]
-                self.redis_tasks[chat_id].cancel()
-                del self.redis_tasks[chat_id]
-
-    async def broadcast(self, chat_id: str, message: str):
+        self.queues.pop(websocket, None)
+
+    def _evict(self, chat_id: str, websocket: WebSocket):
+        """Odłącza klienta, który nie odbiera wiadomości, i zamyka jego WebSocket"""
+        self._drop(chat_id, websocket)
+        writer = self.writer_tasks.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+        # Zamknięcie daje klientowi sygnał do ponownego połączenia
+        task = asyncio.create_task(self._close(websocket))
+        self.close_tasks.add(task)
+        task.add_done_callback(self.close_tasks.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # 1013: Try Again Later
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # Klient już się rozłączył
+
+    def send_to(self, chat_id: str, websocket: WebSocket, message: bytes):
+        """Wysyła wiadomość do jednego klienta, w kolejce razem z pozostałymi"""
+        queue = self.queues.get(websocket)
+        if queue is None:
+            return  # Klient już odłączony
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._evict(chat_id, websocket)
+
+    def broadcast(self, chat_id: str, message: bytes):
         """Wysyła wiadomość do wszystkich użytkowników w danym pokoju"""
-        if chat_id in self.rooms:
-            for connection in self.rooms[chat_id]:
-                await connection.send_text(message)
+        # Wszystkie połączenia dostają te same, zakodowane raz bajty
+        for connection in list(self.rooms.get(chat_id, ())):
+            try:
+                self.queues[connection].put_nowait(message)
+            except (KeyError, asyncio.QueueFull):
+                # Klient nie nadąża z odbiorem - odłączamy go od pokoju
+                self._evict(chat_id, connection)
 
-    async def listen_to_redis(self, chat_id: str):
-        """Jednorazowy nasłuch Redis dla pokoju czatu"""
-        redis = await aioredis.from_url(REDIS_URL, decode_responses=True)
-        pubsub = redis.pubsub()
-        await pubsub.subscribe(f"chat_channel:{chat_id}")
+    async def _writer(self, chat_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """Wysyła zaległe wiadomości paczkami, jedna ramka WebSocket na paczkę"""
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < MAX_BATCH_SIZE:
+                batch.append(queue.get_nowait())
 
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                await self.broadcast(chat_id, message["data"])
+            # Limit czasu dotyczy tylko tego klienta; wolny odbiorca nie blokuje innych
+            try:
+                await asyncio.wait_for(
+                    websocket.send_bytes(b"[" + b",".join(batch) + b"]"),
+                    timeout=SEND_TIMEOUT,
+                )
+            except (WebSocketDisconnect, asyncio.TimeoutError, RuntimeError):
+                self._evict(chat_id, websocket)
+                return
+
+    def _on_notify(self, _conn, _pid: int, _channel: str, payload: str):
+        """Obsługuje NOTIFY w formacie <chat_id>:<json wiadomości> lub <chat_id>:<id>"""
+        chat_id, body = payload.split(":", 1)
+        # Dopóki coś czeka na doczytanie, kolejne wiadomości ustawiają się za tym
+        if self.delivery_backlog == 0 and body.startswith("{"):
+            self.broadcast(chat_id, body.encode("utf-8"))
+            return
+        self.delivery_backlog += 1
+        self.deliveries.put_nowait((chat_id, body))
+
+    async def _deliver_pending(self):
+        while True:
+            chat_id, body = await self.deliveries.get()
+            try:
+                if body.startswith("{"):
+                    self.broadcast(chat_id, body.encode("utf-8"))
+                elif chat_id in self.rooms:
+                    async with SessionLocal() as db:  # type: ignore
+                        message = await db.get(Message, int(body))
+                    if message is not None:
+                        self.broadcast(chat_id, orjson.dumps(message_payload(message)))
+            except Exception:
+                logger.exception("Nie udało się dostarczyć wiadomości %s", body[:32])
+            finally:
+                self.delivery_backlog -= 1
 
 
 manager = ConnectionManager()
 
 
 @ws_router.websocket("/ws/chat/{chat_id}")
-async def chat_endpoint(
-    websocket: WebSocket, chat_id: str, db: AsyncSession = Depends(get_db)
-):
+async def chat_endpoint(websocket: WebSocket, chat_id: int):
 
     token = websocket.query_params.get("token")
     if not token:
@@ -91,37 +344,57 @@ async def chat_endpoint(
         await websocket.close(code=1008)
         return
 
-    redis = await aioredis.from_url(REDIS_URL, decode_responses=True)
-    pubsub = redis.pubsub()
-    await pubsub.subscribe(f"chat_channel:{chat_id}")
-
-    user_db = await db.execute(
-        select(User).options(selectinload(User.chats)).where(User.id == user["sub"])
-    )
-    user_db = user_db.scalar()
+    # Sprawdzamy samo członkostwo, bez ładowania użytkownika i jego czatów.
+    # Krótka sesja zamiast Depends(get_db), żeby otwarty WebSocket nie trzymał
+    # połączenia z puli przez cały czas trwania
+    async with SessionLocal() as db:  # type: ignore
+        is_member = await db.scalar(
+            select(
+                exists().where(
+                    user_chat_association.c.user_id == user["sub"],
+                    user_chat_association.c.chat_id == chat_id,
+                )
+            )
+        )
 
-    if not user_db or chat_id not in [chat.id for chat in user_db.chats]:
+    if not is_member:
         await websocket.close()
         return
-    await manager.connect(str(chat_id), websocket)
 
     try:
+        await manager.connect(str(chat_id), websocket)
         while True:
             data = await websocket.receive_text()
             message = Message(
-                chat_id=chat_id, sender=user["preferred_username"], content=data
+                id=await message_writer.next_id(),
+                chat_id=chat_id,
+                sender=user["preferred_username"],
+                content=data,
+                timestamp=datetime.utcnow(),
+            )
+            notification = f"{chat_id}:".encode() + orjson.dumps(
+                message_payload(message)
+            )
+            if len(notification) > MAX_NOTIFY_PAYLOAD:
+                # Wiadomość trafi do klientów po doczytaniu z bazy
+                notification = f"{chat_id}:{message.id}".encode()
+
+            # Zapis i NOTIFY odbywają się w tle, w jednej transakcji
+            message_writer.enqueue(
+                message,
+                chat_channel(str(chat_id)),
+                notification.decode(),
+                on_failure=functools.partial(
+                    manager.send_to,
+                    str(chat_id),
+                    websocket,
+                    orjson.dumps({"error": "message_not_saved", "id": message.id}),
+                ),
             )
-            # do dodania tam gdzie tworzymy wiadomośc w bazie
-            db.add(message)
-            await db.commit()
-            payload = {
-                "id": message.id,
-                "sender": message.sender,
-                "content": data,
-                "timestamp": message.timestamp.isoformat(),
-            }
-            await redis.publish(f"chat_channel:{chat_id}", json.dumps(payload))
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Sprzątamy również po błędach bazy (np. w next_id), nie tylko po rozłączeniu
         await manager.disconnect(str(chat_id), websocket)
 
 
@@ -157,74 +430,157 @@ async def create_chat(
     return {"message": "Chat created", "chat_id": chat.id}
 
 
+async def fetch_picture(client: httpx.AsyncClient, user_id: str):
+    """Pobiera zdjęcie profilowe użytkownika z user_service (z cache)"""
+    picture = _picture_cache.get(user_id, _MISSING)
+    if picture is not _MISSING:
+        return picture
+
+    try:
+        resp = await client.get(f"{USERS_API_URL}/{user_id}")
+        if resp.status_code == 200:
+            picture = resp.json().get("picture")
+        elif resp.status_code == 404:
+            picture = None
+        else:
+            # Błędów user_service nie zapamiętujemy, następne żądanie spróbuje ponownie
+            return None
+    except Exception:
+        # Błędów sieci również nie zapamiętujemy
+        return None
+
+    _picture_cache[user_id] = picture
+    return picture
+
+
+async def fetch_pictures(client: httpx.AsyncClient, user_ids: Set[str]):
+    """Zwraca słownik {id użytkownika: zdjęcie} dla podanych użytkowników"""
+    pictures = {}
+    missing = []
+    for user_id in user_ids:
+        picture = _picture_cache.get(user_id, _MISSING)
+        if picture is _MISSING:
+            missing.append(user_id)
+        else:
+            pictures[user_id] = picture
+
+    if not missing:
+        return pictures
+
+    # Jedno zbiorcze zapytanie zamiast osobnego GET dla każdego użytkownika
+    try:
+        resp = await client.get(
+            USERS_API_URL, params={"ids": ",".join(sorted(missing))}
+        )
+        resp.raise_for_status()
+        pic_by_id = {u["id"]: u.get("picture") for u in resp.json()}
+    except Exception:
+        # Fallback na pojedyncze zapytania, gdy user_service nie obsługuje ?ids=
+        fetched = await asyncio.gather(*(fetch_picture(client, i) for i in missing))
+        pictures.update(zip(missing, fetched))
+        return pictures
+
+    for user_id in missing:
+        picture = pic_by_id.get(user_id)
+        _picture_cache[user_id] = picture
+        pictures[user_id] = picture
+    return pictures
+
+
 @router.get("/chats/")
 async def list_chats(
-    user=Depends(get_current_user), db: AsyncSession = Depends(get_db)
+    request: Request,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(User)
-        .options(joinedload(User.chats).joinedload(Chat.participants))
-        .where(User.id == user["sub"])
-    )
-    user_db = result.unique().scalar_one_or_none()
+    chats = (
+        await db.execute(
+            select(Chat.id, Chat.name)
+            .join(user_chat_association, user_chat_association.c.chat_id == Chat.id)
+            .where(user_chat_association.c.user_id == user["sub"])
+        )
+    ).all()
 
-    if not user_db:
+    if not chats:
         return []
 
-    async with httpx.AsyncClient() as client:
+    # Uczestnicy wszystkich czatów jednym zapytaniem, tylko potrzebne kolumny
+    participant_rows = await db.execute(
+        select(user_chat_association.c.chat_id, User.id, User.username)
+        .join(User, User.id == user_chat_association.c.user_id)
+        .where(user_chat_association.c.chat_id.in_([chat.id for chat in chats]))
+    )
+    participants: Dict[int, List[tuple]] = defaultdict(list)
+    for chat_id, user_id, username in participant_rows:
+        participants[chat_id].append((user_id, username))
+
+    client: httpx.AsyncClient = request.app.state.http
+    unique_ids = {user_id for rows in participants.values() for user_id, _ in rows}
+    pictures = await fetch_pictures(client, unique_ids)
 
-        async def fetch_picture(participant):
-            try:
-                resp = await client.get(
-                    f"http://user_service:8000/admin/api/users/users/{participant.id}"
-                )
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return data.get("picture")
-                return None
-            except Exception:
-                return None
-
-        chats_response = []
-        for chat in user_db.chats:
-            tasks = [fetch_picture(p) for p in chat.participants]
-            pictures = await asyncio.gather(*tasks)
-            participants_data = [
-                {"id": p.id, "username": p.username, "picture": pictures[idx]}
-                for idx, p in enumerate(chat.participants)
-            ]
-            chats_response.append(
-                {
-                    "id": chat.id,
-                    "name": chat.name,
-                    "participants": participants_data,
-                }
-            )
-    return chats_response
+    return [
+        {
+            "id": chat.id,
+            "name": chat.name,
+            "participants": [
+                {"id": user_id, "username": username, "picture": pictures[user_id]}
+                for user_id, username in participants[chat.id]
+            ],
+        }
+        for chat in chats
+    ]
 
 
 @router.get("/chats/{chat_id}/messages", response_model=List[dict])
 async def get_chat_history(
-    chat_id: str, limit: int = 50, db: AsyncSession = Depends(get_db)
+    chat_id: int,
+    limit: int = 50,
+    before_ts: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
 ):
     """Pobiera historię wiadomości dla danego czatu"""
+    # before_id rozstrzyga tylko remisy na before_ts; samo id nie wyznacza strony
+    if before_id is not None and before_ts is None:
+        raise HTTPException(status_code=422, detail="before_id requires before_ts")
+
+    query = select(Message).where(Message.chat_id == chat_id)
+
+    # Paginacja po kluczu (timestamp, id) ostatniej wiadomości z poprzedniej strony
+    if before_ts is not None:
+        # Kolumna to timestamp without time zone w UTC (datetime.utcnow)
+        if before_ts.tzinfo is not None:
+            before_ts = before_ts.astimezone(timezone.utc).replace(tzinfo=None)
+        if before_id is not None:
+            query = query.where(
+                or_(
+                    Message.timestamp < before_ts,
+                    and_(Message.timestamp == before_ts, Message.id < before_id),
+                )
+            )
+        else:
+            query = query.where(Message.timestamp < before_ts)
+
     result = await db.execute(
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.timestamp.desc())
-        .limit(limit)
+        query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
     )
     messages = result.scalars().all()
 
     if not messages:
+        # Koniec historii przy przewijaniu to pusta strona, a nie błąd
+        if before_ts is not None:
+            return ORJSONResponse([])
         raise HTTPException(status_code=404, detail="No messages found")
 
-    return [
-        {
-            "id": msg.id,
-            "sender": msg.sender,
-            "content": msg.content,
-            "timestamp": msg.timestamp,
-        }
-        for msg in messages
-    ]
+    # ORJSONResponse serializuje datetime bez przechodzenia przez jsonable_encoder
+    return ORJSONResponse(
+        [
+            {
+                "id": msg.id,
+                "sender": msg.sender,
+                "content": msg.content,
+                "timestamp": msg.timestamp,
+            }
+            for msg in messages
+        ]
+    )
@@ -1,14 +1,21 @@
 from app.es import get_es_instance
 
+SEARCH_RESULTS_SIZE = 10
+
 
 async def search_users(query: str):
     """Wyszukuje użytkowników w Elasticsearch"""
     es_client = get_es_instance()
     response = await es_client.search(
         index="users",
-        body={
-            "query": {
-                "prefix": {"username": query},
+        size=SEARCH_RESULTS_SIZE,
+        track_total_hits=False,
+        source=["id", "username", "picture"],
+        query={
+            "multi_match": {
+                "query": query,
+                "type": "bool_prefix",
+                "fields": ["username", "username._2gram", "username._3gram"],
             }
         },
     )